@@ -6,10 +6,16 @@ from pathlib import Path, PurePath
 import argparse
 import time
 import threading
+import wave
 from enum import Enum
 
 # Project files:
+import conform
 import envoptions
+import export
+import incremental
+import pcm
+from metrics import Metrics
 
 """
 Sorting of names works with numbers, so Python can sort the filenames passed
@@ -194,7 +200,7 @@ def connect(config):
     if Path.exists(config.write_path) and Path.exists(config.read_path):
         pass
     else:
-        start_audacity(config.audacity_loc)
+        start_audacity(config)
 
     print("Successfully located Audacity instance.")
     time.sleep(1.0)
@@ -311,11 +317,9 @@ def join():
 # ! Export2 is problematic.  It pulls from the last used preferences
 # ! for options like bitrate, quality, etc.
 # ! Make sure these are correctly set manually.
-def export2(filename):
-    if not filename.endswith(".mp3"):
-        print("Adding .mp3 extension to your output.")
-        filename += ".mp3"
-    return f'Export2: Filename="{filename}" NumChannels=2'
+# Audacity picks the format from the extension.
+def export2(filename, channels=2):
+    return f'Export2: Filename="{filename}" NumChannels={channels}'
 
 
 class Effect(Enum):
@@ -350,9 +354,9 @@ def valid_silence(choice):
 
 def valid_amplify(choice):
     # A valid amplify should be Effect
-    if isinstance(choice, Effect):
-        return choice
-    else:
+    try:
+        return Effect(choice)
+    except ValueError:
         raise argparse.ArgumentTypeError(
             "The argument to amplify must be one of the options specified.  See --help for details."
         )
@@ -365,6 +369,49 @@ def valid_filename(filename):
         return filename
 
 
+def valid_rate(choice):
+    try:
+        rate = int(choice)
+    except ValueError:
+        raise argparse.ArgumentTypeError("The sample rate must be a whole number of Hz.")
+    if rate <= 0:
+        raise argparse.ArgumentTypeError("The sample rate must be positive.")
+    return rate
+
+
+def valid_target(choice):
+    try:
+        return export.parse_target(choice)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+def audio_seconds(paths):
+    """Total length of the WAV files among paths.  Other files can't be measured
+    without Audacity, and aren't counted."""
+    seconds = 0.0
+    for p in paths:
+        if Path(p).suffix.lower() == ".wav":
+            try:
+                seconds += conform.duration(p)
+            except wave.Error:
+                # WAVE_FORMAT_EXTENSIBLE or float; the wave module can't read them.
+                pass
+    return seconds
+
+
+def resolve_output(output_name, config):
+    if (output_path := PurePath(output_name)).is_absolute():
+        output = output_name
+        print(f"Saving to path: {output}")
+    else:
+        # If the path is not valid, do away with it.
+        name_ext = output_path.name
+        output = str(config.default_loc / name_ext)
+        print(f"Saving to default path: {output}")
+    return output
+
+
 def main():
     parser = argparse.ArgumentParser()
     regular_or_config = parser.add_mutually_exclusive_group(required=True)
@@ -372,9 +419,10 @@ def main():
     regular_or_config.add_argument(
         "-o",
         "--output",
-        help="Determines the output file's name.",
-        metavar="FILENAME.ext",
-        type=valid_filename,
+        help="Determines the output file's name.  Give it more than once to export several formats or bitrates from one render, e.g. -o album.mp3:320 -o album-128.mp3:128 -o album.flac",
+        metavar="FILENAME.ext[:KBPS]",
+        action="append",
+        type=valid_target,
     )
     parser.add_argument(
         "-a",
@@ -417,6 +465,34 @@ def main():
         action="store_true",
         help="Set options such as where to store your music and where your Audacity instance is located."
     )
+    parser.add_argument(
+        "-n",
+        "--native",
+        action="store_true",
+        help="Join WAV files in Python instead of Audacity.  Outputs other than .wav need ffmpeg.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=valid_rate,
+        help="Sample rate to conform WAV inputs to.  Defaults to the most common rate among them.",
+    )
+    parser.add_argument(
+        "--channels",
+        type=int,
+        choices=[1, 2],
+        help="Channels to conform WAV inputs to.  Defaults to the most among them.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="With --native, process every track again instead of only those that changed since the last run.",
+    )
+    parser.add_argument(
+        "--metrics",
+        default=os.getenv("AUDACIOUS_METRICS_FILE"),
+        metavar="FILE.prom",
+        help="Write run metrics to this file, in the Prometheus textfile format.  Defaults to $AUDACIOUS_METRICS_FILE.",
+    )
 
 
     # This means I can't add a count argument that is required when I
@@ -427,22 +503,57 @@ def main():
     # TODO: Add "individually" option, which will apply an effect to each track individually.  May require sequential file opening.  Useful for amplifying some movements differently from others.
     # Use groups?
 
-    args = parser.parse_args()
-    
-    if args.envoptions:
-        envoptions.set_options()
-        return
-    
-    if config := envoptions.find_options() is None:
-        sys.exit("Your options have not yet been set.  Run this script with the flag '--envoptions' to configure it.")
+    # Look for --metrics before anything else can fail, so that bad arguments
+    # and bad options are counted as failed runs too.  Setting options and
+    # asking for help aren't runs.
+    early = argparse.ArgumentParser(add_help=False)
+    early.add_argument("--metrics", default=os.getenv("AUDACIOUS_METRICS_FILE"))
+    early.add_argument("-n", "--native", action="store_true")
+    early.add_argument("-h", "--help", "--envoptions", dest="not_a_run", action="store_true")
+    known, _ = early.parse_known_args()
+    metrics = Metrics(None if known.not_a_run else known.metrics)
+    metrics.inc("audacious_jobs_total", path="native" if known.native else "audacity")
+
+    succeeded = False
+    try:
+        args = parser.parse_args()
+
+        if args.envoptions:
+            envoptions.set_options()
+            return
+
+        # The native path never opens Audacity, so it doesn't need to find it.
+        if (config := envoptions.find_options(need_audacity=not args.native)) is None:
+            sys.exit("Your options have not yet been set.  Run this script with the flag '--envoptions' to configure it.")
+
+        join_album(parser, args, config, metrics)
+        succeeded = True
+    finally:
+        # A successful run breaks the pipe itself, when end_audacity() closes
+        # Audacity; only a broken pipe in a failed run means Audacity died.
+        if not succeeded and AudacityInstance.reader_pipe_broken.is_set():
+            metrics.inc("audacious_audacity_restarts_total")
+        metrics.finish(succeeded)
 
+
+def join_album(parser, args, config, metrics):
     files = args.FILES
-    output_name = args.output
+    targets = args.output
     amplify_type = args.amplify
     do_truncate = args.truncate
     some_silence = args.silence
     path_specified = args.path
     sort_specified = args.classical
+    use_native = args.native
+    do_normalize = amplify_type == Effect.combined
+
+    try:
+        if use_native:
+            export.check_encoder(targets)
+        else:
+            export.split_for_audacity(targets)
+    except RuntimeError as err:
+        parser.error(str(err))
 
     # TODO: Reorganize main, and then pass args object to them. Or, pass just needed args.
     # Parts: import, export, increment, combined, etc.
@@ -488,8 +599,62 @@ def main():
 
     # ! Don't forget to close the file handle, then delete it. Also, delete file.name.
 
-    instance = connect(config)
-    initialize_audacity()
+    targets = [export.Target(resolve_output(t.path, config), t.bitrate) for t in targets]
+    lof_paths = pcm.read_lof(lof_filepath)
+
+    if use_native:
+        # No Audacity needed; the same steps are done in Python.  Tracks that
+        # haven't changed since the last run for these outputs are reused.
+        readable = conform.probe_wavs(lof_paths)
+        if unreadable := [p for p in lof_paths if p not in readable]:
+            if not lof_specified:
+                remove_lof_file(lof_filepath)
+            parser.error(
+                f"--native can only join PCM WAV files of 8 to 32 bits, and {Path(unreadable[0]).name} isn't one.  Join it without --native."
+            )
+        album_key = "|".join(sorted(str(Path(t.path).resolve()) for t in targets))
+        with metrics.stage("render"):
+            audio = incremental.render(
+                lof_paths,
+                album_key,
+                do_truncate,
+                do_normalize,
+                rate=args.rate,
+                channels=args.channels,
+                force=args.rebuild,
+            )
+        with metrics.stage("export"):
+            try:
+                written = export.export_audio(audio, targets)
+            except RuntimeError as err:
+                sys.exit(str(err))
+        metrics.inc("audacious_audio_seconds_processed_total", audio_seconds(lof_paths))
+        metrics.inc("audacious_output_bytes_total", sum(written))
+        if not lof_specified:
+            remove_lof_file(lof_filepath)
+        print("Script successful.")
+        return
+
+    # Bring mismatched WAV inputs to one rate and channel layout up front, so
+    # that Audacity has nothing to resample when mixing.
+    with metrics.stage("conform"):
+        conformed, target = conform.conform_paths(lof_paths, args.rate, args.channels)
+        if conformed != lof_paths:
+            with create_lof_file() as lof_file:
+                lof_filepath = Path(lof_file.name).resolve(strict=True)
+                lof_file.write(create_lof_string(conformed))
+            # The conformed .lof is ours to clean up, even if the user gave one.
+            lof_specified = False
+        # Audacity decides the layout of anything that wasn't conformed, so
+        # only export fewer than 2 channels when every track was.
+        if target is not None and len(conform.probe_wavs(lof_paths)) == len(lof_paths):
+            export_channels = target[1]
+        else:
+            export_channels = max(2, target[1]) if target is not None else 2
+
+    with metrics.stage("connect"):
+        instance = connect(config)
+        initialize_audacity()
 
     # ! Audacity can only handle a maximum of 16 tracks.
     # ! But there are plenty of situations in which we want to mix more than that!
@@ -520,44 +685,56 @@ def main():
     # def silence_independently():
     # do()
 
-    do(import2(lof_filepath))
-    do(enable_cursor())
-
-    align_all()
-    if do_truncate:
-        truncate_all()
-    # if silence_type.value == "ind":
-    #     silence_independently()
-    align_all()
-    mix_render_all()
-    if amplify_type == "comb":
-        normalize_all()
-
-    # ! Why does generating any noise not allow you to specify a duration?
-    # ! Why does generating noise generate over the whole file?
-    # * These questions are answered on the forums.  In short,
-    # * there is no actual macro for inserting silence.
-    do(select_none())
-    do(enable_cursor())
-    do(start_secs(2))
-    do(start_silence())
-    do(end_secs(2))
-    do(end_silence())
-    do(select_all())
-    do(join())
-
-    if (output_path := PurePath(output_name)).is_absolute():
-        output = output_name
-        print(f"Saving to path: {output}")
-    else:
-        # If the path is not valid, do away with it.
-        name_ext = output_path.name
-        output = config.default_loc + name_ext
-        print(f"Saving to default path: {output}")
+    with metrics.stage("import"):
+        do(import2(lof_filepath))
+        do(enable_cursor())
+
+    with metrics.stage("effects"):
+        align_all()
+        if do_truncate:
+            truncate_all()
+        # if silence_type.value == "ind":
+        #     silence_independently()
+        align_all()
+        mix_render_all()
+        if do_normalize:
+            normalize_all()
+
+        # ! Why does generating any noise not allow you to specify a duration?
+        # ! Why does generating noise generate over the whole file?
+        # * These questions are answered on the forums.  In short,
+        # * there is no actual macro for inserting silence.
+        do(select_none())
+        do(enable_cursor())
+        do(start_secs(2))
+        do(start_silence())
+        do(end_secs(2))
+        do(end_silence())
+        do(select_all())
+        do(join())
 
     # ! The resulting quality of the output file is lower than the originals.  Egads!
     # ! TODO: Investigate the cause of lower quality output.
-    do(export2(output))
+    # The project is rendered once, whatever the number of targets.
+    with metrics.stage("export"):
+        # Audacity exports what ffmpeg can't (everything, without ffmpeg) in
+        # turn.  The rest are encoded by ffmpeg at the same time, from one
+        # master that Audacity exports.
+        own, encoded = export.split_for_audacity(targets)
+        for target in own:
+            do(export2(target.path, export_channels))
+        written = [Path(t.path).stat().st_size for t in own if Path(t.path).exists()]
+        if encoded:
+            master = export.new_master()
+            do(export2(str(master), export_channels))
+            try:
+                written += export.export_master(master, encoded)
+            except RuntimeError as err:
+                sys.exit(str(err))
+            finally:
+                Path.unlink(master, missing_ok=True)
+    metrics.inc("audacious_audio_seconds_processed_total", audio_seconds(lof_paths))
+    metrics.inc("audacious_output_bytes_total", sum(written))
 
     if not lof_specified:
         remove_lof_file(lof_filepath)
@@ -0,0 +1,288 @@
+#! python3
+
+"""
+Benchmarks the native processing paths against a corpus made by corpus.py.
+
+Each measurement runs in a fresh process, so that peak RSS belongs to that one
+path and album and not to whatever ran before it.  For every path and album we
+record wall time, peak RSS and bytes per second.  Results can be saved as JSON
+and compared against a saved baseline; a throughput drop beyond the tolerance
+is reported as a regression, and the script exits with status 1.
+
+The audacity path times audio-join.py end to end on the default (Audacity)
+path, so it needs Audacity and options set with --envoptions; it is skipped
+otherwise.  Audacity does the work in its own process, so its peak RSS is
+reported as n/a.
+
+    python corpus.py bench-corpus
+    python bench.py bench-corpus --json baseline.json
+    ... change things ...
+    python bench.py bench-corpus --baseline baseline.json
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is reported as n/a there.
+    resource = None
+
+# Project files:
+import conform
+import envoptions
+import incremental
+import pcm
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def load(paths):
+    return [pcm.read_wav(p) for p in paths]
+
+
+def bench_read(paths):
+    load(paths)
+    return sum(Path(p).stat().st_size for p in paths)
+
+
+def bench_trim(tracks):
+    [pcm.trim_silence(t) for t in tracks]
+    return sum(t.nbytes for t in tracks)
+
+
+def bench_normalize(tracks):
+    [pcm.normalize(t) for t in tracks]
+    return sum(t.nbytes for t in tracks)
+
+
+def conform_all(tracks):
+    rate, channels = conform.choose_format([(t.rate, t.channels) for t in tracks])
+    return [conform.conform(t, rate, channels) for t in tracks]
+
+
+def bench_conform(tracks):
+    conform_all(tracks)
+    return sum(t.nbytes for t in tracks)
+
+
+def bench_join(tracks):
+    # Mixed albums are conformed first, outside of the timing.
+    if len({(t.rate, t.channels) for t in tracks}) > 1:
+        tracks = conform_all(tracks)
+    start = time.perf_counter()
+    joined = pcm.join(tracks)
+    return joined.nbytes, time.perf_counter() - start
+
+
+def bench_render(paths):
+    # A fresh cache each time, so conversions are paid for in the timing.
+    with tempfile.TemporaryDirectory() as scratch:
+        conformed, _ = conform.conform_paths(paths, cache_dir=scratch)
+        audio = pcm.render(conformed, do_truncate=True, do_normalize=True)
+        pcm.write_wav(Path(scratch) / "joined.wav", audio)
+    return sum(Path(p).stat().st_size for p in paths)
+
+
+def bench_rejoin(paths):
+    # Join the album once, then change its middle entry and time the rerun.
+    with tempfile.TemporaryDirectory() as scratch:
+        paths = list(paths)
+        middle = len(paths) // 2
+        stand_in = Path(scratch) / "stand-in.wav"
+        shutil.copyfile(paths[middle], stand_in)
+        paths[middle] = stand_in
+        incremental.render(paths, "bench", do_truncate=True, do_normalize=True, cache_dir=scratch)
+
+        changed = pcm.read_wav(stand_in)
+        changed.samples *= 0.5
+        pcm.write_wav(stand_in, changed)
+        start = time.perf_counter()
+        incremental.render(paths, "bench", do_truncate=True, do_normalize=True, cache_dir=scratch)
+        wall = time.perf_counter() - start
+        processed = sum(Path(p).stat().st_size for p in paths)
+    return processed, wall
+
+
+SCRIPT = Path(__file__).resolve().with_name("audio-join.py")
+# Audacity can't hold more tracks than this at once.
+AUDACITY_MAX_TRACKS = 16
+
+
+def bench_audacity(lof):
+    if len(pcm.read_lof(lof)) > AUDACITY_MAX_TRACKS:
+        raise ValueError(f"Audacity can't join more than {AUDACITY_MAX_TRACKS} tracks.")
+    try:
+        config = envoptions.find_options()
+    except SystemExit:
+        config = None
+    if config is None:
+        raise RuntimeError("Audacity isn't set up; run audio-join.py --envoptions first.")
+    # Don't count benchmark runs in the user's metrics.
+    env = {k: v for k, v in os.environ.items() if k != "AUDACIOUS_METRICS_FILE"}
+    with tempfile.TemporaryDirectory() as scratch:
+        output = Path(scratch) / "joined.wav"
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT), str(lof), "-t", "-a", "c", "-o", str(output)],
+            capture_output=True,
+            text=True,
+            env=env,
+        )
+        wall = time.perf_counter() - start
+        # audio-join.py exits with 0 even when it fails; look for the output instead.
+        if not output.exists():
+            raise RuntimeError(f"audio-join.py failed: {(result.stderr or result.stdout).strip()[-200:]}")
+    return sum(Path(p).stat().st_size for p in pcm.read_lof(lof)), wall
+
+
+# Paths that work on tracks already in memory; loading them isn't timed.
+IN_MEMORY = {"trim": bench_trim, "normalize": bench_normalize, "conform": bench_conform, "join": bench_join}
+# Paths that start from the files.
+ON_DISK = {"read": bench_read, "render": bench_render, "rejoin": bench_rejoin}
+# Paths that run the whole script on the .lof.
+END_TO_END = {"audacity": bench_audacity}
+PATHS = ["read", "trim", "normalize", "conform", "join", "render", "rejoin", "audacity"]
+
+
+def measure(path_name, lof):
+    """Runs one path on one album.  Meant to be called in a fresh process."""
+    paths = pcm.read_lof(lof)
+    try:
+        if path_name in IN_MEMORY:
+            work, given = IN_MEMORY[path_name], load(paths)
+        elif path_name in ON_DISK:
+            work, given = ON_DISK[path_name], paths
+        else:
+            work, given = END_TO_END[path_name], lof
+        start = time.perf_counter()
+        processed = work(given)
+        wall = time.perf_counter() - start
+        if isinstance(processed, tuple):
+            # The path timed itself, leaving out its own setup.
+            processed, wall = processed
+    except (ValueError, RuntimeError) as err:
+        return {"skipped": str(err)}
+    return {
+        "wall_secs": wall,
+        # The work of an end to end run happens in other processes.
+        "peak_rss_bytes": None if path_name in END_TO_END else peak_rss(),
+        "bytes": processed,
+        "bytes_per_sec": processed / wall if wall > 0 else float("inf"),
+    }
+
+
+def run(lofs, path_names, repeat):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for lof in lofs:
+        for path_name in path_names:
+            best = None
+            for _ in range(repeat):
+                with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+                    result = pool.submit(measure, path_name, str(lof)).result()
+                if "skipped" in result:
+                    best = result
+                    break
+                if best is None or result["wall_secs"] < best["wall_secs"]:
+                    best = result
+            best.update({"path": path_name, "album": lof.name, "entries": len(pcm.read_lof(lof))})
+            results.append(best)
+            print_result(best)
+    return results
+
+
+def format_bytes(count):
+    if count is None:
+        return "n/a"
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if count < 1024 or unit == "GiB":
+            return f"{count:.1f} {unit}"
+        count /= 1024
+
+
+def print_result(result):
+    label = f"{result['path']:<10} {result['album']:<32}"
+    if "skipped" in result:
+        print(f"{label} skipped: {result['skipped']}")
+    else:
+        print(
+            f"{label} {result['wall_secs']:9.4f} s  "
+            f"{format_bytes(result['bytes_per_sec']):>12}/s  "
+            f"peak RSS {format_bytes(result['peak_rss_bytes'])}"
+        )
+
+
+def compare(results, baseline, tolerance):
+    """Returns the results whose throughput fell more than tolerance below the baseline."""
+    before = {(b["path"], b["album"]): b for b in baseline if "skipped" not in b}
+    regressions = []
+    for result in results:
+        old = before.get((result["path"], result["album"]))
+        if old is None or "skipped" in result:
+            continue
+        if result["bytes_per_sec"] < old["bytes_per_sec"] * (1 - tolerance):
+            regressions.append((result, old))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the native processing paths.")
+    parser.add_argument("CORPUS", help="A directory generated by corpus.py.")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=PATHS, help="Which paths to run.")
+    parser.add_argument("--max-entries", type=int, help="Skip albums with more entries than this.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per measurement; the fastest is kept.")
+    parser.add_argument("--json", help="Save the results to this file.")
+    parser.add_argument("--baseline", help="Compare against results saved earlier with --json.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Fraction of baseline throughput that may be lost before it counts as a regression.",
+    )
+    args = parser.parse_args()
+
+    lofs = sorted(Path(args.CORPUS).glob("*.lof"))
+    if args.max_entries is not None:
+        lofs = [lof for lof in lofs if len(pcm.read_lof(lof)) <= args.max_entries]
+    if not lofs:
+        parser.error("No .lof files found in the corpus.  Generate one with corpus.py first.")
+
+    results = run(lofs, args.paths, args.repeat)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for result, old in regressions:
+            print(
+                f"Regression: {result['path']} on {result['album']} dropped from "
+                f"{format_bytes(old['bytes_per_sec'])}/s to {format_bytes(result['bytes_per_sec'])}/s."
+            )
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Conforms tracks to one sample rate and channel layout before joining.
+
+Albums are not always uniform: a 44.1 kHz CD rip may come with 48 kHz bonus
+tracks, or an archival movement may be mono.  Rather than leaving it to
+Audacity's project rate during MixAndRender, every mismatched WAV is resampled
+with a polyphase filter and remapped to the target channels here, so the join
+is a straight concatenation of samples.
+
+Converted tracks are cached as 32 bit WAV files, keyed on the source file and
+the target format, so a second run over the same album converts nothing.
+"""
+
+import hashlib
+import os
+import time
+import wave
+from collections import Counter
+from math import gcd
+from pathlib import Path
+
+import numpy as np
+
+# Project files:
+import envoptions
+import pcm
+
+# Output frames computed per step of the resampler; bounds its memory use.
+CHUNK_FRAMES = 1 << 14
+
+# Cached conversions not used for this long are deleted.
+MAX_AGE_SECS = 30 * 24 * 3600
+
+
+def probe(path):
+    """Returns (rate, channels) of a WAV file without reading its samples."""
+    with wave.open(str(path), "rb") as wav:
+        return (wav.getframerate(), wav.getnchannels())
+
+
+def duration(path):
+    """Length of a WAV file in seconds, from its header."""
+    with wave.open(str(path), "rb") as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def probe_wavs(paths):
+    """Returns the (rate, channels) of every WAV among paths that can be
+    conformed.  The wave module can't read WAVE_FORMAT_EXTENSIBLE or float
+    files, which Audacity imports fine, so those are left out."""
+    formats = {}
+    for p in paths:
+        if Path(p).suffix.lower() != ".wav":
+            continue
+        try:
+            formats[p] = probe(p)
+        except wave.Error:
+            pass
+    return formats
+
+
+def choose_format(formats, rate=None, channels=None):
+    """Picks the target format for an album from the (rate, channels) of its
+    tracks.  The most common rate wins, the higher one on a tie, so that the
+    majority of tracks are left untouched.  Channels go to the widest layout."""
+    if rate is not None and rate <= 0:
+        raise ValueError(f"Cannot conform to a sample rate of {rate} Hz.")
+    if channels is not None and channels <= 0:
+        raise ValueError(f"Cannot conform to {channels} channels.")
+    if rate is None:
+        counts = Counter(r for r, _ in formats)
+        rate = max(counts, key=lambda r: (counts[r], r))
+    if channels is None:
+        channels = max(c for _, c in formats)
+    return (rate, channels)
+
+
+def design_filter(up, down, zero_crossings=10, beta=5.0):
+    """Kaiser windowed sinc lowpass for resampling by up/down.
+    Returns the taps, scaled for a gain of one after upsampling, and the delay."""
+    factor = max(up, down)
+    half = zero_crossings * factor
+    cutoff = 1.0 / factor
+    n = np.arange(-half, half + 1)
+    taps = cutoff * np.sinc(cutoff * n) * np.kaiser(2 * half + 1, beta)
+    taps *= up / taps.sum()
+    return taps, half
+
+
+def resample(samples, src_rate, dst_rate):
+    """Polyphase resampling of (frames, channels) samples.
+
+    Conceptually this upsamples by up, lowpasses and keeps every down-th sample.
+    Only the taps that land on real (non-inserted) samples are ever multiplied,
+    so each output frame costs len(taps) / up multiplies per channel."""
+    if src_rate == dst_rate:
+        return samples
+    g = gcd(src_rate, dst_rate)
+    up, down = dst_rate // g, src_rate // g
+    taps, delay = design_filter(up, down)
+
+    # phases[p, j] is taps[p + j * up]: the sub-filter for output phase p.
+    per_phase = -(-len(taps) // up)
+    taps = np.pad(taps, (0, per_phase * up - len(taps)))
+    phases = taps.reshape(per_phase, up).T.astype(np.float32)
+
+    frames = samples.shape[0]
+    out_frames = -(-frames * up // down)
+    # Where each output frame falls in the upsampled signal, shifted by the
+    # filter delay so the output lines up with the input.
+    position = np.arange(out_frames, dtype=np.int64) * down + delay
+    base = position // up
+    phase = position % up
+
+    right = max(0, int(base[-1]) + 1 - frames) if out_frames else 0
+    padded = np.pad(samples, ((per_phase, right), (0, 0)))
+    offsets = np.arange(per_phase)
+
+    out = np.empty((out_frames, samples.shape[1]), dtype=np.float32)
+    for start in range(0, out_frames, CHUNK_FRAMES):
+        stop = min(start + CHUNK_FRAMES, out_frames)
+        index = base[start:stop, None] + per_phase - offsets[None, :]
+        out[start:stop] = np.einsum("nj,njc->nc", phases[phase[start:stop]], padded[index])
+    return out
+
+
+def channel_matrix(src, dst):
+    """Mixing matrix from src channels to dst channels.  Downmixing averages the
+    channels that fold together; upmixing copies channels round robin."""
+    matrix = np.zeros((src, dst), dtype=np.float32)
+    for d in range(dst):
+        sources = [s for s in range(src) if s % dst == d] or [d % src]
+        matrix[sources, d] = 1.0 / len(sources)
+    return matrix
+
+
+def map_channels(samples, channels):
+    if samples.shape[1] == channels:
+        return samples
+    return samples @ channel_matrix(samples.shape[1], channels)
+
+
+def conform(audio, rate, channels):
+    """Converts an Audio to the given rate and channels."""
+    # Map first when it removes channels, so there is less to resample.
+    if channels < audio.channels:
+        return pcm.Audio(resample(map_channels(audio.samples, channels), audio.rate, rate), rate)
+    return pcm.Audio(map_channels(resample(audio.samples, audio.rate, rate), channels), rate)
+
+
+def cache_key(path, rate, channels):
+    stat = Path(path).stat()
+    ident = f"{Path(path).resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{rate}|{channels}"
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+
+def conform_file(path, rate, channels, cache_dir):
+    """Returns the path of a copy of path in the target format, converting it
+    only if the cache doesn't have one already."""
+    cached = Path(cache_dir) / (cache_key(path, rate, channels) + ".wav")
+    if cached.exists():
+        # Mark it as used, so prune() keeps it.
+        os.utime(cached)
+    else:
+        print(f"Conforming {Path(path).name} to {rate} Hz, {channels} channels.")
+        audio = conform(pcm.read_wav(path), rate, channels)
+        # Write under a temporary name so an interrupted run can't leave a
+        # truncated file in the cache.
+        partial = cached.with_suffix(".part")
+        pcm.write_wav(partial, audio, width=4)
+        os.replace(partial, cached)
+    return cached
+
+
+def prune(cache_dir, max_age_secs=MAX_AGE_SECS):
+    """Deletes cached conversions (and leftovers of interrupted ones) that
+    haven't been used for max_age_secs."""
+    cutoff = time.time() - max_age_secs
+    for cached in list(Path(cache_dir).glob("*.wav")) + list(Path(cache_dir).glob("*.part")):
+        try:
+            if cached.stat().st_mtime < cutoff:
+                cached.unlink()
+        except FileNotFoundError:
+            # Another run got to it first.
+            pass
+
+
+def conform_paths(paths, rate=None, channels=None, cache_dir=None):
+    """Conforms every WAV in paths to a common format.
+    Returns the paths to join, in order, and the (rate, channels) chosen.
+    Anything that isn't a WAV the wave module reads is passed through for
+    Audacity to deal with."""
+    wavs = probe_wavs(paths)
+    if not wavs:
+        return (list(paths), None)
+    target = choose_format(list(wavs.values()), rate, channels)
+    if cache_dir is None:
+        cache_dir = envoptions.find_cache() / "conform"
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    conformed = []
+    for p in paths:
+        if p in wavs and wavs[p] != target:
+            conformed.append(conform_file(p, *target, cache_dir))
+        else:
+            conformed.append(p)
+    prune(cache_dir)
+    return (conformed, target)
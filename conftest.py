@@ -0,0 +1,2 @@
+# pipe_test.py is a script that talks to a running Audacity, not a test module.
+collect_ignore = ["pipe_test.py"]
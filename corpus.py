@@ -0,0 +1,167 @@
+#! python3
+
+"""
+Generates synthetic albums to test and benchmark joining on.
+
+Every track is a WAV file with a known amount of leading and trailing silence
+and, on some tracks, a quiet passage in the middle (think of a violin cadenza
+that stops for breath).  Silence here is a noise floor well under the -59 db
+truncation threshold, since real rips are never digitally silent.
+
+Tracks come in a few formats (sample rate, channels, bit depth) so that the
+corpus looks like a real mixed collection.  Each .lof lists between 2 and
+thousands of entries; the large ones reuse the same pool of tracks, so the
+corpus stays small on disk while the joined output still grows.
+
+A corpus.json manifest records what went into every track, so the expected
+result of trimming can be checked.
+
+    python corpus.py bench-corpus --sizes 2 16 128 1024
+"""
+
+import argparse
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+
+# Project files:
+import pcm
+
+# (rate, channels, bytes per sample)
+FORMATS = [
+    (44100, 2, 2),
+    (48000, 2, 3),
+    (22050, 1, 2),
+]
+
+NOISE_FLOOR_DB = -80.0
+MUSIC_PEAK_DB = -3.0
+
+
+def synthesize(seconds, rate, channels, lead_secs, tail_secs, cadenza, rng):
+    """Builds the samples of one track.  cadenza is (start_secs, secs) within
+    the music, or None."""
+    floor = pcm.db_to_amplitude(NOISE_FLOOR_DB)
+    frames = int(round(seconds * rate))
+    lead = int(round(lead_secs * rate))
+    tail = int(round(tail_secs * rate))
+    body = max(frames - lead - tail, 1)
+
+    # A few partials with a slow swell, so the music isn't a constant tone.
+    t = np.arange(body, dtype=np.float64) / rate
+    music = np.zeros(body)
+    for _ in range(3):
+        freq = rng.uniform(110.0, 1760.0)
+        music += np.sin(2 * np.pi * freq * t + rng.uniform(0, 2 * np.pi))
+    music *= 0.6 + 0.4 * np.sin(2 * np.pi * rng.uniform(0.05, 0.5) * t)
+    # The swell must not dip under the threshold at the very ends of the
+    # music, or trimming would cut more than the planned silence.
+    music[0] = music[-1] = 1.0
+    music *= pcm.db_to_amplitude(MUSIC_PEAK_DB) / np.abs(music).max()
+    if cadenza is not None:
+        start = int(round(cadenza[0] * rate))
+        music[start : start + int(round(cadenza[1] * rate))] = 0.0
+
+    signal = np.concatenate((np.zeros(lead), music, np.zeros(tail)))
+    samples = np.repeat(signal[:, None], channels, axis=1)
+    samples += rng.normal(0.0, floor / 3, samples.shape).clip(-floor, floor)
+    return pcm.Audio(samples.astype(np.float32), rate)
+
+
+def generate_track(path, seconds, rate, channels, width, seed):
+    """Writes one track and returns its manifest entry."""
+    rng = np.random.default_rng(seed)
+    lead_secs = round(float(rng.uniform(0.0, min(2.0, seconds / 4))), 3)
+    tail_secs = round(float(rng.uniform(0.0, min(2.0, seconds / 4))), 3)
+    music_secs = seconds - lead_secs - tail_secs
+    cadenza = None
+    # Only the longer tracks get room for a quiet passage.
+    if music_secs > 3.0 and rng.random() < 0.5:
+        cadenza_secs = round(float(rng.uniform(0.5, music_secs / 3)), 3)
+        cadenza = (round(music_secs / 3, 3), cadenza_secs)
+    audio = synthesize(seconds, rate, channels, lead_secs, tail_secs, cadenza, rng)
+    pcm.write_wav(path, audio, width)
+    return {
+        "file": str(path),
+        "seconds": seconds,
+        "rate": rate,
+        "channels": channels,
+        "width": width,
+        "lead_secs": lead_secs,
+        "tail_secs": tail_secs,
+        "cadenza": cadenza,
+    }
+
+
+def write_lof(path, track_paths):
+    with open(path, "w") as lof:
+        lof.write("\n".join(f'file "{p}"' for p in track_paths))
+
+
+def generate_corpus(directory, sizes, seed=0, tracks=8, min_secs=0.5, max_secs=6.0):
+    """Generates a pool of tracks per format and .lof files of the given sizes.
+    Each size gets one album in a single format (the formats take turns) and one
+    album that mixes all of them."""
+    directory = Path(directory).resolve()
+    (directory / "tracks").mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+
+    pools = []
+    manifest = {"seed": seed, "tracks": [], "albums": []}
+    for rate, channels, width in FORMATS:
+        pool = []
+        for i in range(tracks):
+            path = directory / "tracks" / f"{rate}-{channels}ch-{width * 8}bit-{i:02d}.wav"
+            seconds = round(rng.uniform(min_secs, max_secs), 3)
+            entry = generate_track(path, seconds, rate, channels, width, rng.getrandbits(32))
+            manifest["tracks"].append(entry)
+            pool.append(path)
+            print(f"Generated {path.name}")
+        pools.append(pool)
+
+    everything = [p for pool in pools for p in pool]
+    for i, size in enumerate(sizes):
+        rate, channels, width = FORMATS[i % len(FORMATS)]
+        albums = [
+            (f"album-{size:05d}-{rate}-{channels}ch.lof", pools[i % len(pools)], False),
+            (f"mixed-{size:05d}.lof", everything, True),
+        ]
+        for name, pool, mixed in albums:
+            entries = [rng.choice(pool) for _ in range(size)]
+            write_lof(directory / name, entries)
+            manifest["albums"].append({"lof": name, "entries": size, "mixed": mixed})
+            print(f"Generated {name}")
+
+    with open(directory / "corpus.json", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus of albums to join.")
+    parser.add_argument("DIRECTORY", help="Where to put the corpus.")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[2, 16, 128, 1024],
+        help="Numbers of entries in the generated .lof files.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed, so corpora can be reproduced.")
+    parser.add_argument("--tracks", type=int, default=8, help="Distinct tracks to generate per format.")
+    parser.add_argument("--min-secs", type=float, default=0.5, help="Shortest track length.")
+    parser.add_argument("--max-secs", type=float, default=6.0, help="Longest track length.")
+    args = parser.parse_args()
+
+    if any(size < 2 for size in args.sizes):
+        parser.error("An album needs at least two entries to join.")
+    if not 0 < args.min_secs <= args.max_secs:
+        parser.error("Track lengths must be positive, with --min-secs no more than --max-secs.")
+
+    generate_corpus(args.DIRECTORY, args.sizes, args.seed, args.tracks, args.min_secs, args.max_secs)
+
+
+if __name__ == "__main__":
+    main()
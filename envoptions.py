@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import sys
 
 class Config:
     def __init__(self, default, audacity, write, read, eol):
@@ -28,9 +29,10 @@ def find_config():
         windows_appdata = Path(os.getenv("APPDATA"))
         config_dir = windows_appdata / "audacious_appendment"
     else:
-        if unix_xdg := os.getenv("XDG_CONFIG_HOME") is None:
-            unix_home = Path(os.getenv("HOME"))
-            config_dir = unix_home / ".config" / "audacious_appendment"
+        unix_xdg = os.getenv("XDG_CONFIG_HOME")
+        if unix_xdg is None:
+            unix_xdg = Path(os.getenv("HOME")) / ".config"
+        config_dir = Path(unix_xdg) / "audacious_appendment"
     try:
         Path.mkdir(config_dir, parents=True)
     except FileExistsError:
@@ -38,7 +40,21 @@ def find_config():
     return config_dir / "env.txt"
 
 
-def find_options():
+def find_cache():
+    if os.name == "nt":
+        cache_dir = Path(os.getenv("LOCALAPPDATA")) / "audacious_appendment" / "cache"
+    else:
+        unix_cache = os.getenv("XDG_CACHE_HOME")
+        if unix_cache is None:
+            unix_cache = Path(os.getenv("HOME")) / ".cache"
+        cache_dir = Path(unix_cache) / "audacious_appendment"
+    Path.mkdir(cache_dir, parents=True, exist_ok=True)
+    return cache_dir
+
+
+def find_options(need_audacity=True):
+    """Reads the saved options.  Pass need_audacity=False to accept a config
+    whose Audacity location is no longer valid, e.g. for --native runs."""
     (write_path, read_path, eol) = find_os_pipes()
     config = find_config()
     if not config.is_file():
@@ -46,12 +62,13 @@ def find_options():
     else:
         with open(config, "r") as config_file:
             settings = config_file.readlines()
-            default_save_loc = settings[0].removeprefix("Default save location: ")
-            audacity_loc = settings[1].removeprefix("Audacity executable location: ")
-            if not Path.is_dir(default_save_loc) or not (Path.is_file(audacity_loc) and os.access(audacity_loc, os.X_OK)):
+            default_save_loc = Path(settings[0].strip().removeprefix("Default save location: "))
+            audacity_loc = Path(settings[1].strip().removeprefix("Audacity executable location: "))
+            audacity_ok = audacity_loc.is_file() and os.access(audacity_loc, os.X_OK)
+            if not default_save_loc.is_dir() or (need_audacity and not audacity_ok):
                 sys.exit("Your options are invalid and need to be reset.  Run this script with the flag '--envoptions' to set them up.")
             else:
-            return Config(default_save_loc, audacity_loc, write_path, read_path, eol)
+                return Config(default_save_loc, audacity_loc, write_path, read_path, eol)
 
 
 def set_options():
@@ -0,0 +1,162 @@
+"""
+Exports one rendered album to several formats at once.
+
+The album is mixed, normalized and padded once, into a master WAV.  Every
+deliverable (an MP3 at each bitrate, a FLAC master, ...) is then encoded from
+that master by its own ffmpeg process, all of them running at the same time.
+WAV deliverables are written directly, and don't need ffmpeg.  On the Audacity
+path, formats ffmpeg isn't set up for here are left to Audacity's Export2.
+"""
+
+import concurrent.futures
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path, PurePath
+
+# Project files:
+import envoptions
+import pcm
+
+# ffmpeg arguments per extension.
+CODECS = {
+    ".mp3": ["-c:a", "libmp3lame"],
+    ".ogg": ["-c:a", "libvorbis"],
+    ".opus": ["-c:a", "libopus"],
+    ".m4a": ["-c:a", "aac"],
+    ".flac": ["-c:a", "flac"],
+    ".wav": ["-c:a", "pcm_s16le"],
+}
+LOSSLESS = {".flac", ".wav"}
+
+
+class Target:
+    """One deliverable: where to write it, and at what bitrate (in kbps) if lossy."""
+
+    def __init__(self, path, bitrate=None):
+        self.path = path
+        self.bitrate = bitrate
+
+    @property
+    def suffix(self):
+        return PurePath(self.path).suffix.lower()
+
+    def __str__(self):
+        return self.path if self.bitrate is None else f"{self.path} at {self.bitrate} kbps"
+
+
+def parse_target(choice):
+    """Parses FILENAME.ext or FILENAME.ext:BITRATE, e.g. album.mp3:320.
+    Raises ValueError if it doesn't make sense."""
+    path, bitrate = choice, None
+    # Only split on a colon followed by a number, so D:\music\album.mp3 is fine.
+    head, sep, tail = choice.rpartition(":")
+    if sep and tail.lower().removesuffix("k").removeprefix("-").isdigit():
+        path, bitrate = head, int(tail.lower().removesuffix("k"))
+    target = Target(path, bitrate)
+    # Whether the format can be written depends on who writes it; see
+    # check_encoder() and split_for_audacity().
+    if target.suffix == "":
+        raise ValueError("Cannot export to a file without an extension.")
+    if bitrate is not None and target.suffix in LOSSLESS:
+        raise ValueError(f"{target.suffix} is lossless, and takes no bitrate.")
+    if bitrate is not None and bitrate <= 0:
+        raise ValueError(f"Cannot export {path} at {bitrate} kbps; the bitrate must be positive.")
+    return target
+
+
+def find_encoder():
+    return shutil.which("ffmpeg")
+
+
+def encode_command(encoder, master, target):
+    command = [encoder, "-y", "-loglevel", "error", "-i", str(master), *CODECS[target.suffix]]
+    if target.bitrate is not None:
+        command += ["-b:a", f"{target.bitrate}k"]
+    return command + [str(target.path)]
+
+
+def encode(encoder, master, target):
+    print(f"Exporting {target}.")
+    result = subprocess.run(encode_command(encoder, master, target), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not export {target}: {result.stderr.strip()}")
+    return Path(target.path).stat().st_size
+
+
+def write_wav(audio, target):
+    print(f"Exporting {target}.")
+    return pcm.write_wav(target.path, audio)
+
+
+def run_all(jobs):
+    """Runs (function, *args) jobs concurrently.  Returns their results in order."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as pool:
+        futures = [pool.submit(*job) for job in jobs]
+        return [f.result() for f in futures]
+
+
+def check_encoder(targets):
+    """Raises RuntimeError if some target needs ffmpeg and it can't be found,
+    or is in a format ffmpeg isn't set up for here."""
+    needs = [t for t in targets if t.suffix != ".wav"]
+    for target in needs:
+        if target.suffix not in CODECS:
+            raise RuntimeError(f"Cannot export to {target.suffix} without Audacity.")
+    if needs and find_encoder() is None:
+        raise RuntimeError(f"ffmpeg is needed to export {needs[0]}, but it isn't on your PATH.")
+
+
+def split_for_audacity(targets):
+    """Splits targets into those Audacity exports itself and those ffmpeg
+    encodes from Audacity's master.  Audacity's Export2 can't be given a
+    bitrate, so raises RuntimeError if a target with one can't go to ffmpeg."""
+    encoder = find_encoder()
+    own = [t for t in targets if encoder is None or t.suffix not in CODECS]
+    for target in own:
+        if target.bitrate is not None:
+            if encoder is None:
+                raise RuntimeError(f"ffmpeg is needed to export {target}, but it isn't on your PATH.")
+            raise RuntimeError(f"Cannot export {target}; only {', '.join(s for s in CODECS if s not in LOSSLESS)} take a bitrate.")
+    return (own, [t for t in targets if t not in own])
+
+
+def new_master():
+    """A fresh temporary path for a master WAV, so concurrent runs don't share one."""
+    handle, master = tempfile.mkstemp(suffix=".wav", dir=envoptions.find_cache())
+    os.close(handle)
+    return Path(master)
+
+
+def export_master(master, targets):
+    """Encodes every target from a master file already on disk, e.g. one
+    exported by Audacity.  Returns the bytes written for each target."""
+    check_encoder(targets)
+    encoder = find_encoder()
+    return run_all([(encode, encoder, master, target) for target in targets])
+
+
+def export_audio(audio, targets):
+    """Exports a rendered Audio to every target.  WAV targets are written
+    straight from memory; the rest share one master file.
+    Returns the bytes written for each target."""
+    check_encoder(targets)
+    encoded = [t for t in targets if t.suffix != ".wav"]
+    master = None
+    if encoded:
+        # 32 bit, so the master adds no quantization of its own.
+        master = new_master()
+        pcm.write_wav(master, audio, width=4)
+    try:
+        encoder = find_encoder()
+        jobs = []
+        for target in targets:
+            if target.suffix == ".wav":
+                jobs.append((write_wav, audio, target))
+            else:
+                jobs.append((encode, encoder, master, target))
+        return run_all(jobs)
+    finally:
+        if master is not None:
+            Path(master).unlink()
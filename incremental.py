@@ -0,0 +1,285 @@
+"""
+Incremental re-joining for the native path.
+
+Each track is processed once into a segment (conformed, and trimmed if asked)
+and cached under the hash of the source file's contents.  The joined master of
+an album is kept as well, along with a manifest of where every segment starts
+and ends in it.
+
+On a rerun, only the entries whose contents changed are processed; their
+segments are spliced into the cached master at the recorded boundaries, and
+the boundaries after them are shifted.  If normalizing, the whole master is
+only rescaled when the loudest peak of the album actually changed.
+
+Entries are compared by position, so reordering tracks splices each moved
+track back in.  Anything else that changed (the number of entries, the target
+format, the options) makes a full rebuild, which still reuses every cached
+segment.
+
+Albums not joined for a while are dropped from the cache, and with them any
+segment that no remaining album uses.
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Project files:
+import conform
+import envoptions
+import pcm
+
+MANIFEST_VERSION = 1
+
+# Albums not joined for this long are dropped from the cache.
+MAX_AGE_SECS = 30 * 24 * 3600
+# Unreferenced segments younger than this are kept: a run that is still going
+# may have made them without saving its manifest yet.
+GRACE_SECS = 3600
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_of(path):
+    stat = Path(path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def hash_paths(paths, previous):
+    """Hashes every path, reusing the hashes in previous (manifest entries) for
+    files whose size and modification time haven't changed."""
+    known = {(e["path"], tuple(e["stat"])): e["hash"] for e in previous}
+    hashes = []
+    for p in paths:
+        key = (str(p), tuple(stat_of(p)))
+        hashes.append(known[key] if key in known else content_hash(p))
+    return hashes
+
+
+def segment_name(digest, rate, channels, do_truncate):
+    return f"{digest}-{rate}-{channels}-{'t' if do_truncate else 'f'}.npy"
+
+
+def load_segment(path, digest, rate, channels, do_truncate, cache_dir, force=False):
+    """Returns the processed samples of one track, from the cache if possible
+    and not forced to process it again."""
+    cached = Path(cache_dir) / segment_name(digest, rate, channels, do_truncate)
+    if cached.exists() and not force:
+        return np.load(cached)
+    print(f"Processing {Path(path).name}.")
+    audio = conform.conform(pcm.read_wav(path), rate, channels)
+    if do_truncate:
+        audio = pcm.trim_silence(audio)
+    partial = cached.with_suffix(".part")
+    with open(partial, "wb") as f:
+        np.save(f, audio.samples)
+    os.replace(partial, cached)
+    return audio.samples
+
+
+def segment_peak(samples):
+    return float(np.abs(samples).max()) if samples.size else 0.0
+
+
+def gain_for(peak, do_normalize):
+    if not do_normalize or peak == 0.0:
+        return 1.0
+    return 1.0 / peak
+
+
+def job_files(key, cache_dir):
+    """The master and manifest of the album identified by key."""
+    name = hashlib.sha1(key.encode()).hexdigest()
+    return (Path(cache_dir) / f"{name}.wav", Path(cache_dir) / f"{name}.json")
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+
+def save_manifest(manifest_path, manifest):
+    partial = manifest_path.with_suffix(".part")
+    with open(partial, "w") as f:
+        json.dump(manifest, f)
+    os.replace(partial, manifest_path)
+
+
+def save(master_path, manifest_path, audio, manifest):
+    # The old manifest goes first, so an interrupted run leaves the old pair
+    # or nothing usable, never a master that disagrees with its manifest.
+    partial = master_path.with_suffix(".part")
+    pcm.write_wav(partial, audio, width=4)
+    manifest_path.unlink(missing_ok=True)
+    os.replace(partial, master_path)
+    save_manifest(manifest_path, manifest)
+
+
+def prune(segment_dir, job_dir, max_age_secs=MAX_AGE_SECS):
+    """Deletes albums that haven't been joined for max_age_secs, then every
+    segment that no album left in the cache refers to."""
+    now = time.time()
+    referenced = set()
+    for manifest_path in Path(job_dir).glob("*.json"):
+        master_path = manifest_path.with_suffix(".wav")
+        try:
+            if manifest_path.stat().st_mtime < now - max_age_secs:
+                manifest_path.unlink()
+                master_path.unlink(missing_ok=True)
+                continue
+        except FileNotFoundError:
+            continue
+        manifest = load_manifest(manifest_path)
+        if manifest is None:
+            continue
+        settings = manifest["settings"]
+        for e in manifest["entries"]:
+            referenced.add(segment_name(e["hash"], settings["rate"], settings["channels"], settings["truncate"]))
+
+    # Masters whose manifest is gone, and leftovers of interrupted writes.
+    leftovers = [m for m in Path(job_dir).glob("*.wav") if not m.with_suffix(".json").exists()]
+    leftovers += list(Path(job_dir).glob("*.part")) + list(Path(segment_dir).glob("*.part"))
+    unused = [s for s in Path(segment_dir).glob("*.npy") if s.name not in referenced]
+    for stale in leftovers + unused:
+        try:
+            if stale.stat().st_mtime < now - GRACE_SECS:
+                stale.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def rebuild(paths, hashes, settings, segment_dir, force=False):
+    rate, channels = settings["rate"], settings["channels"]
+    segments = [
+        load_segment(p, h, rate, channels, settings["truncate"], segment_dir, force) for p, h in zip(paths, hashes)
+    ]
+    peaks = [segment_peak(s) for s in segments]
+    peak = max(peaks)
+    gain = gain_for(peak, settings["normalize"])
+    pad = int(round(settings["silence_secs"] * rate))
+
+    entries = []
+    start = pad
+    for p, h, s, top in zip(paths, hashes, segments, peaks):
+        entries.append(
+            {"path": str(p), "stat": stat_of(p), "hash": h, "start": start, "frames": len(s), "peak": top}
+        )
+        start += len(s)
+    joined = pcm.join([pcm.Audio(s, rate) for s in segments])
+    joined.samples *= np.float32(gain)
+    audio = pcm.pad_silence(joined, settings["silence_secs"], settings["silence_secs"])
+    return (audio, {"version": MANIFEST_VERSION, "settings": settings, "peak": peak, "gain": gain, "entries": entries})
+
+
+def splice(master, manifest, paths, hashes, segment_dir):
+    """Replaces the changed entries of master in place of the old ones."""
+    settings = manifest["settings"]
+    entries = manifest["entries"]
+    changed = [i for i, h in enumerate(hashes) if h != entries[i]["hash"]]
+    segments = {
+        i: load_segment(paths[i], hashes[i], settings["rate"], settings["channels"], settings["truncate"], segment_dir)
+        for i in changed
+    }
+
+    peak = max(segment_peak(segments[i]) if i in segments else e["peak"] for i, e in enumerate(entries))
+    gain = gain_for(peak, settings["normalize"])
+    samples = master.samples
+    if gain != manifest["gain"]:
+        print("The album's peak changed; normalizing again.")
+        samples = samples * np.float32(gain / manifest["gain"])
+
+    # Splice back to front, so the boundaries still to be used don't move.
+    pieces = []
+    end = len(samples)
+    for i in reversed(changed):
+        e = entries[i]
+        pieces.append(samples[e["start"] + e["frames"] : end])
+        pieces.append(segments[i] * np.float32(gain))
+        end = e["start"]
+    pieces.append(samples[:end])
+    samples = np.concatenate(pieces[::-1])
+
+    shift = 0
+    for i, (p, h) in enumerate(zip(paths, hashes)):
+        e = entries[i]
+        e["start"] += shift
+        if i in segments:
+            shift += len(segments[i]) - e["frames"]
+            e.update({"frames": len(segments[i]), "peak": segment_peak(segments[i])})
+        e.update({"path": str(p), "stat": stat_of(p), "hash": h})
+    manifest.update({"peak": peak, "gain": gain})
+    return (pcm.Audio(samples, master.rate), manifest)
+
+
+def render(
+    paths,
+    key,
+    do_truncate=False,
+    do_normalize=False,
+    silence_secs=2,
+    rate=None,
+    channels=None,
+    force=False,
+    cache_dir=None,
+):
+    """Does what pcm.render() does, reusing as much of the last run for the same
+    key (the album's outputs) as it can, or nothing if force is set.
+    Returns the rendered Audio."""
+    if cache_dir is None:
+        cache_dir = envoptions.find_cache()
+    segment_dir = Path(cache_dir) / "segments"
+    job_dir = Path(cache_dir) / "joins"
+    segment_dir.mkdir(parents=True, exist_ok=True)
+    job_dir.mkdir(parents=True, exist_ok=True)
+
+    rate, channels = conform.choose_format([conform.probe(p) for p in paths], rate, channels)
+    settings = {
+        "rate": rate,
+        "channels": channels,
+        "truncate": do_truncate,
+        "normalize": do_normalize,
+        "silence_secs": silence_secs,
+    }
+    master_path, manifest_path = job_files(key, job_dir)
+    manifest = None if force else load_manifest(manifest_path)
+    reusable = (
+        manifest is not None
+        and master_path.exists()
+        and manifest["settings"] == settings
+        and len(manifest["entries"]) == len(paths)
+    )
+    hashes = hash_paths(paths, manifest["entries"] if manifest is not None else [])
+
+    if not reusable:
+        audio, manifest = rebuild(paths, hashes, settings, segment_dir, force)
+    else:
+        changed = [i for i, h in enumerate(hashes) if h != manifest["entries"][i]["hash"]]
+        master = pcm.read_wav(master_path)
+        if not changed:
+            print("Nothing changed since the last run.")
+            # Files may have been touched without changing; remember the new
+            # stats so they aren't hashed again next time.
+            for p, e in zip(paths, manifest["entries"]):
+                e.update({"path": str(p), "stat": stat_of(p)})
+            save_manifest(manifest_path, manifest)
+            prune(segment_dir, job_dir)
+            return master
+        print(f"Re-joining {len(changed)} changed track(s) of {len(paths)}.")
+        audio, manifest = splice(master, manifest, paths, hashes, segment_dir)
+    save(master_path, manifest_path, audio, manifest)
+    prune(segment_dir, job_dir)
+    return audio
@@ -0,0 +1,193 @@
+"""
+Run metrics in the Prometheus textfile format.
+
+Point node_exporter's textfile collector at the file given to --metrics (or
+the AUDACIOUS_METRICS_FILE environment variable).  Every run reads the file
+back in before adding to it, so counters and histograms keep counting across
+runs, as Prometheus expects.  A run only keeps its own increments in memory
+and merges them into the file under a lock when it finishes, so runs that
+overlap on one host don't lose each other's counts.  The file is replaced
+atomically, so the collector never sees half of one.
+"""
+
+import contextlib
+import math
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Windows.
+    fcntl = None
+    import msvcrt
+
+# Upper bounds of the stage duration buckets, in seconds.
+BUCKETS = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf]
+
+# name: (type, help)
+FAMILIES = {
+    "audacious_jobs_total": ("counter", "Join runs started, by processing path."),
+    "audacious_job_failures_total": ("counter", "Join runs that failed, by the stage they failed in."),
+    "audacious_stage_duration_seconds": ("histogram", "Time spent in each stage of a join run."),
+    "audacious_audacity_restarts_total": (
+        "counter",
+        "Times the pipe from Audacity broke during a run (reader_pipe_broken), so Audacity has to be restarted.",
+    ),
+    "audacious_audio_seconds_processed_total": ("counter", "Seconds of input audio joined by successful runs."),
+    "audacious_output_bytes_total": ("counter", "Bytes of output files written."),
+    "audacious_last_run_success": ("gauge", "1 if the last run succeeded, 0 if it failed."),
+    "audacious_last_run_timestamp_seconds": ("gauge", "When the last run finished, in seconds since the epoch."),
+}
+
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})?\s+(\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def family_of(name):
+    for suffix in ["_bucket", "_sum", "_count"]:
+        base = name.removesuffix(suffix)
+        if base != name and FAMILIES.get(base, ("",))[0] == "histogram":
+            return base
+    return name
+
+
+def is_gauge(name):
+    return FAMILIES.get(family_of(name), ("",))[0] == "gauge"
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Holds an exclusive lock on path (created if needed) while in the block."""
+    with open(path, "a+") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        else:
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class Metrics:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        # This run's own changes: (name, ((label, value), ...)) -> increment,
+        # or the new value for gauges.
+        self.samples = {}
+        self.failed = False
+
+    def load(self):
+        samples = {}
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    match = SAMPLE.match(line.strip())
+                    if match is None or line.startswith("#"):
+                        continue
+                    name, labels, value = match.groups()
+                    labels = tuple(sorted(LABEL.findall(labels or "")))
+                    samples[(name, labels)] = float(value)
+        except FileNotFoundError:
+            pass
+        return samples
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.samples[key] = self.samples.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        self.samples[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        for bound in BUCKETS:
+            if value <= bound:
+                self.inc(name + "_bucket", le=format_value(bound), **labels)
+        self.inc(name + "_sum", value, **labels)
+        self.inc(name + "_count", **labels)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times a stage of the run, and counts it as the failed stage if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            # SystemExit too: that's how this script reports most errors.
+            self.inc("audacious_job_failures_total", stage=name)
+            self.failed = True
+            raise
+        finally:
+            self.observe("audacious_stage_duration_seconds", time.perf_counter() - start, stage=name)
+
+    def finish(self, succeeded):
+        """Records the outcome of the run and writes the file.  A file that can't
+        be written is only warned about; it mustn't change how the run ends."""
+        if not succeeded and not self.failed:
+            # It failed before getting to any stage.
+            self.inc("audacious_job_failures_total", stage="setup")
+        self.set("audacious_last_run_success", 1 if succeeded else 0)
+        self.set("audacious_last_run_timestamp_seconds", time.time())
+        try:
+            self.write()
+        except OSError as err:
+            print(f"Warning: couldn't write metrics to {self.path}: {err}", file=sys.stderr)
+
+    def render(self, samples):
+        def order(key):
+            name, labels = key
+            le = dict(labels).get("le")
+            rest = tuple(l for l in labels if l[0] != "le")
+            return (name, rest, float(le.replace("+Inf", "inf")) if le else 0.0)
+
+        lines = []
+        for family, (kind, help_text) in FAMILIES.items():
+            keys = sorted((k for k in samples if family_of(k[0]) == family), key=order)
+            if not keys:
+                continue
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            for name, labels in keys:
+                # le goes last, as Prometheus writes it.
+                label_text = ",".join(f'{k}="{v}"' for k, v in sorted(labels, key=lambda l: l[0] == "le"))
+                label_text = "{" + label_text + "}" if label_text else ""
+                lines.append(f"{name}{label_text} {format_value(samples[(name, labels)])}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Merges this run's changes into the file."""
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with locked(self.path.with_name(self.path.name + ".lock")):
+            # Read the file only now, so whatever other runs wrote since this
+            # one started is kept.
+            samples = self.load()
+            # Unlabelled counters start at 0, so rate() works before the first event.
+            for name in [
+                "audacious_audacity_restarts_total",
+                "audacious_audio_seconds_processed_total",
+                "audacious_output_bytes_total",
+            ]:
+                samples.setdefault((name, ()), 0)
+            for key, value in self.samples.items():
+                samples[key] = value if is_gauge(key[0]) else samples.get(key, 0) + value
+            partial = self.path.with_name(self.path.name + ".part")
+            with open(partial, "w") as f:
+                f.write(self.render(samples))
+            os.replace(partial, self.path)
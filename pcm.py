@@ -0,0 +1,157 @@
+"""
+Native PCM processing, for when we don't want to drive Audacity.
+
+Everything here works on WAV files read with the standard library's wave
+module and held in memory as numpy float32 arrays of shape (frames, channels),
+scaled to [-1.0, 1.0].  The operations mirror the Audacity commands that
+audio-join.py sends down the pipe: truncate, mix end to end, normalize, and
+surround with silence.
+"""
+
+import wave
+from pathlib import Path
+
+import numpy as np
+
+
+# Same threshold as truncate() in audio-join.py.
+SILENCE_THRESHOLD_DB = -59.0
+
+
+class Audio:
+    def __init__(self, samples, rate):
+        self.samples = samples
+        self.rate = rate
+
+    @property
+    def frames(self):
+        return self.samples.shape[0]
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def seconds(self):
+        return self.frames / self.rate
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes
+
+
+def db_to_amplitude(db):
+    return 10.0 ** (db / 20.0)
+
+
+def read_wav(path):
+    """Reads a PCM WAV file into an Audio.  8, 16, 24 and 32 bit are supported."""
+    with wave.open(str(path), "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        # 8 bit WAV is the odd one out: unsigned, centered on 128.
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        data = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        # No numpy dtype for 24 bit; put each sample in the top of an int32.
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        data = ((b[:, 0] << 8) | (b[:, 1] << 16) | (b[:, 2] << 24)).astype(np.float32) / 2147483648.0
+    elif width == 4:
+        data = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"{path} has an unsupported sample width of {width} bytes.")
+    return Audio(data.reshape(-1, channels), rate)
+
+
+def write_wav(path, audio, width=2):
+    """Writes an Audio out as a PCM WAV file with the given sample width in bytes."""
+    clipped = np.clip(audio.samples, -1.0, 1.0)
+    if width == 2:
+        raw = np.round(clipped * 32767.0).astype("<i2").tobytes()
+    elif width == 3:
+        # Drop the low byte of each little-endian int32.
+        ints = np.round(clipped.astype(np.float64) * 2147483647.0).astype("<i4")
+        raw = ints.view(np.uint8).reshape(-1, 4)[:, 1:].tobytes()
+    elif width == 4:
+        raw = np.round(clipped.astype(np.float64) * 2147483647.0).astype("<i4").tobytes()
+    else:
+        raise ValueError(f"Cannot write WAV files with a sample width of {width} bytes.")
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(audio.channels)
+        wav.setsampwidth(width)
+        wav.setframerate(audio.rate)
+        wav.writeframes(raw)
+    return Path(path).stat().st_size
+
+
+def trim_silence(audio, threshold_db=SILENCE_THRESHOLD_DB):
+    """Cuts the silence off both ends of a track.
+    Unlike Audacity's TruncateSilence, quiet passages inside the track (cadenzas
+    and the like) are left alone."""
+    loud = np.flatnonzero(np.abs(audio.samples).max(axis=1) > db_to_amplitude(threshold_db))
+    if loud.size == 0:
+        return Audio(audio.samples[:0], audio.rate)
+    return Audio(audio.samples[loud[0] : loud[-1] + 1], audio.rate)
+
+
+def peak(audio):
+    if audio.frames == 0:
+        return 0.0
+    return float(np.abs(audio.samples).max())
+
+
+def normalize(audio, peak_db=0.0):
+    """Scales audio to the given peak, like Normalize: PeakLevel=0."""
+    current = peak(audio)
+    if current == 0.0:
+        return audio
+    return Audio(audio.samples * np.float32(db_to_amplitude(peak_db) / current), audio.rate)
+
+
+def pad_silence(audio, start_secs, end_secs):
+    """Surrounds audio with digital silence, like start_silence() and end_silence()."""
+    start = np.zeros((int(round(start_secs * audio.rate)), audio.channels), dtype=np.float32)
+    end = np.zeros((int(round(end_secs * audio.rate)), audio.channels), dtype=np.float32)
+    return Audio(np.concatenate((start, audio.samples, end)), audio.rate)
+
+
+def join(tracks):
+    """Puts tracks end to end.  They must share a sample rate and channel count."""
+    first = tracks[0]
+    for track in tracks[1:]:
+        if track.rate != first.rate or track.channels != first.channels:
+            raise ValueError(
+                f"Cannot join a {track.rate} Hz, {track.channels} channel track onto "
+                f"a {first.rate} Hz, {first.channels} channel one."
+            )
+    return Audio(np.concatenate([t.samples for t in tracks]), first.rate)
+
+
+def render(paths, do_truncate=False, do_normalize=False, silence_secs=2):
+    """The whole native pipeline: the same steps main() asks Audacity to do."""
+    tracks = [read_wav(p) for p in paths]
+    if do_truncate:
+        tracks = [trim_silence(t) for t in tracks]
+    mixed = join(tracks)
+    if do_normalize:
+        mixed = normalize(mixed)
+    return pad_silence(mixed, silence_secs, silence_secs)
+
+
+def read_lof(filepath):
+    """Returns the paths listed in a .lof file, in order."""
+    paths = []
+    with open(filepath, "r") as lof:
+        for line in lof:
+            line = line.strip()
+            if line.startswith('file "') and line.endswith('"'):
+                path = Path(line[len('file "') : -1])
+                if not path.is_absolute():
+                    path = Path(filepath).parent / path
+                paths.append(path)
+    return paths
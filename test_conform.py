@@ -0,0 +1,56 @@
+"""
+Checks the resampler and the channel mixing used to conform tracks.
+"""
+
+import numpy as np
+import pytest
+
+# Project files:
+import conform
+
+
+def sine(freq, rate, seconds=0.5):
+    t = np.arange(int(rate * seconds)) / rate
+    return np.sin(2 * np.pi * freq * t)[:, None].astype(np.float32)
+
+
+def middle(samples):
+    # The ends are where the filter runs off the signal; leave them out.
+    return samples[len(samples) // 4 : 3 * len(samples) // 4]
+
+
+@pytest.mark.parametrize("src_rate, dst_rate", [(44100, 48000), (48000, 44100), (22050, 44100), (48000, 22050)])
+def test_resampled_sine_keeps_its_phase(src_rate, dst_rate):
+    out = conform.resample(sine(1000, src_rate), src_rate, dst_rate)
+    assert len(out) == len(sine(1000, dst_rate))
+    assert np.abs(middle(out) - middle(sine(1000, dst_rate))).max() < 2e-3
+
+
+@pytest.mark.parametrize("src_rate, dst_rate", [(44100, 48000), (48000, 44100), (48000, 22050)])
+def test_resampling_keeps_dc_gain(src_rate, dst_rate):
+    out = conform.resample(np.ones((src_rate // 2, 2), dtype=np.float32), src_rate, dst_rate)
+    assert np.abs(middle(out) - 1).max() < 1e-3
+
+
+def test_tone_above_new_nyquist_is_filtered():
+    # 15 kHz can't be represented at 22.05 kHz; it must not alias down.
+    out = conform.resample(sine(15000, 48000), 48000, 22050)
+    assert np.sqrt(np.mean(middle(out) ** 2)) < 0.01
+
+
+def test_same_rate_is_untouched():
+    samples = sine(1000, 44100)
+    assert conform.resample(samples, 44100, 44100) is samples
+
+
+def test_channel_matrices():
+    np.testing.assert_array_equal(conform.channel_matrix(1, 2), [[1.0, 1.0]])
+    np.testing.assert_array_equal(conform.channel_matrix(2, 1), [[0.5], [0.5]])
+    np.testing.assert_array_equal(conform.channel_matrix(2, 2), np.eye(2))
+
+
+def test_map_channels():
+    stereo = np.array([[0.2, 0.6], [-1.0, 1.0]], dtype=np.float32)
+    np.testing.assert_allclose(conform.map_channels(stereo, 1), [[0.4], [0.0]])
+    mono = np.array([[0.3], [-0.5]], dtype=np.float32)
+    np.testing.assert_array_equal(conform.map_channels(mono, 2), np.repeat(mono, 2, axis=1))
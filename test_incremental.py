@@ -0,0 +1,117 @@
+"""
+Checks that re-joining an album incrementally gives the same result as
+rendering it from scratch.
+"""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+# Project files:
+import conform
+import corpus
+import incremental
+import pcm
+
+RATE = 22050
+
+
+def write_track(path, seconds, level=1.0, seed=0):
+    rng = np.random.default_rng(seed)
+    audio = corpus.synthesize(seconds, RATE, 2, 0.3, 0.4, None, rng)
+    audio.samples *= np.float32(level)
+    pcm.write_wav(path, audio)
+    # Rewrites within the same clock tick must still look changed.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000 * seed))
+
+
+def fresh_render(paths, tmp_path):
+    conformed, _ = conform.conform_paths(paths, cache_dir=tmp_path / "conform")
+    return pcm.render(conformed, do_truncate=True, do_normalize=True)
+
+
+@pytest.fixture
+def album(tmp_path):
+    paths = [tmp_path / f"{i}.wav" for i in range(4)]
+    for i, (seconds, level) in enumerate([(1.0, 0.5), (1.5, 1.0), (0.8, 0.7), (1.2, 0.6)]):
+        write_track(paths[i], seconds, level, seed=i + 1)
+    return paths
+
+
+def rejoin(paths, tmp_path):
+    return incremental.render(paths, "album", do_truncate=True, do_normalize=True, cache_dir=tmp_path / "cache")
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        # The loudest track gets quieter and shorter, so the peak changes.
+        lambda paths: write_track(paths[1], 0.6, 0.4, seed=11),
+        lambda paths: write_track(paths[2], 2.5, 0.7, seed=12),
+        lambda paths: write_track(paths[0], 1.0, 1.3, seed=13),
+        # A quieter track changes, so the album isn't normalized again.
+        lambda paths: write_track(paths[3], 0.9, 0.3, seed=14),
+    ],
+)
+def test_splice_matches_fresh_render(album, tmp_path, change):
+    rejoin(album, tmp_path)
+    change(album)
+    spliced = rejoin(album, tmp_path)
+    expected = fresh_render(album, tmp_path)
+    assert spliced.frames == expected.frames
+    assert np.abs(spliced.samples - expected.samples).max() < 1e-6
+
+
+def test_successive_splices_use_shifted_boundaries(album, tmp_path):
+    rejoin(album, tmp_path)
+    # A longer track early on moves the boundaries of everything after it...
+    write_track(album[0], 2.0, 0.5, seed=31)
+    rejoin(album, tmp_path)
+    # ...which the next splice has to use.
+    write_track(album[2], 0.5, 0.7, seed=32)
+    spliced = rejoin(album, tmp_path)
+    expected = fresh_render(album, tmp_path)
+    assert spliced.frames == expected.frames
+    assert np.abs(spliced.samples - expected.samples).max() < 1e-6
+
+
+def test_reorder_matches_fresh_render(album, tmp_path):
+    rejoin(album, tmp_path)
+    album[0], album[3] = album[3], album[0]
+    spliced = rejoin(album, tmp_path)
+    expected = fresh_render(album, tmp_path)
+    assert spliced.frames == expected.frames
+    assert np.abs(spliced.samples - expected.samples).max() < 1e-6
+
+
+def test_force_processes_every_track_again(album, tmp_path):
+    rejoin(album, tmp_path)
+    # A damaged segment is only fixed by forcing a rebuild.
+    for segment in (tmp_path / "cache" / "segments").glob("*.npy"):
+        np.save(segment, np.zeros((10, 2), dtype=np.float32))
+    rebuilt = incremental.render(
+        album, "album", do_truncate=True, do_normalize=True, force=True, cache_dir=tmp_path / "cache"
+    )
+    expected = fresh_render(album, tmp_path)
+    assert rebuilt.frames == expected.frames
+    assert np.abs(rebuilt.samples - expected.samples).max() < 1e-6
+
+
+def test_prune_drops_unreferenced_segments(album, tmp_path):
+    rejoin(album, tmp_path)
+    segment_dir = tmp_path / "cache" / "segments"
+    before = set(segment_dir.glob("*.npy"))
+    write_track(album[2], 0.9, 0.5, seed=21)
+    rejoin(album, tmp_path)
+    replaced = (set(segment_dir.glob("*.npy")) - before, before - set(segment_dir.glob("*.npy")))
+    assert len(replaced[0]) == 1 and not replaced[1]
+
+    # Past the grace period, the replaced track's old segment goes.
+    old = time.time() - incremental.GRACE_SECS - 1
+    for segment in segment_dir.glob("*.npy"):
+        os.utime(segment, (old, old))
+    incremental.prune(segment_dir, tmp_path / "cache" / "joins")
+    assert len(set(segment_dir.glob("*.npy"))) == len(album)